@@ -5,25 +5,28 @@ import numpy as np
 # Set paths
 merged_raw_path = "data/raw/merged.csv"
 output_dir = "data/clean"  # New target location
-os.makedirs(output_dir, exist_ok=True)
 
-# Load merged dataset (already includes DEMO)
-df = pd.read_csv(merged_raw_path, dtype={"SEQN": str})
+# Set SEQN_DEMO_LEGACY_CSV=1 to fall back to the C parser and CSV-only output;
+# that path needs only pandas, so pyarrow is imported inside the default path
+legacy_csv = os.environ.get("SEQN_DEMO_LEGACY_CSV", "0") == "1"
 
-# Replace placeholder float with NaN
-placeholder = 5.397605346934028e-79
-df.replace(placeholder, np.nan, inplace=True)
+# Sleep/wake clock times (HH:MM text) are never modeled and never reach the
+# numeric invalid-code filter, so skip them at read time
+skip_cols = ["SLQ300", "SLQ310", "SLQ320", "SLQ330"]
+
+# merged.csv is streamed in chunks so rows rejected by the filters never
+# accumulate; Arrow blocks are sized in bytes, C-parser chunks in rows
+chunk_bytes = 64 << 20
+chunk_rows = 200_000
 
-# Filter: Adults (18+) who completed both interview and exam
-df = df[(df["RIDAGEYR"] >= 18) & (df["RIDSTATR"] == 2)]
+# SAS transport placeholder that pandas reads in place of missing values
+placeholder = 5.397605346934028e-79
 
-# Remove invalid codes: 7, 9, 77, 99
+# Invalid codes: refused / don't know
 invalid_vals = [7, 9, 77, 99]
-for col in df.columns:
-    if df[col].dtype in [np.int64, np.float64]:
-        df = df[~df[col].isin(invalid_vals)]
 
-# Drop columns not used in modeling — keep all DEMO columns
+# Drop columns not used in modeling — keep all DEMO columns.
+# These are still read because their codes feed the invalid-code filter.
 drop_cols = [
     # Functioning (FNQ_L)
     "FNQ021", "FNQ041", "FNQ050", "FNQ060", "FNQ080", "FNQ100", "FNQ110", "FNQ120",
@@ -33,11 +36,8 @@ drop_cols = [
     # Hospital Utilization and Access to Care (HUQ_L)
     "HUQ010", "HUQ085",
     # Income (INQ_L)
-    "INQ300", "IND310", "INDFMMPC", "INDFMPIR",
-    # Sleep (SLQ_L)
-    "SLQ300", "SLQ310", "SLQ320", "SLQ330"
+    "INQ300", "IND310", "INDFMMPC", "INDFMPIR"
 ]
-df.drop(columns=[col for col in drop_cols if col in df.columns], inplace=True)
 
 # Rename columns for readability and modeling
 column_mapping = {
@@ -65,29 +65,13 @@ column_mapping = {
     "INDFMMPI": "Monthly poverty index",
     "SLD012": "Sleep hours - weekdays or workdays",
     "SLD013": "Sleep hours - weekends",
+    "DPQ100": "Difficulty these problems have caused",
 }
-df.rename(columns=column_mapping, inplace=True)
 
-# Filter: PHQ-9 valid (≥6 non-null answers)
 phq9_items = [
     "DPQ010", "DPQ020", "DPQ030", "DPQ040", "DPQ050",
     "DPQ060", "DPQ070", "DPQ080", "DPQ090"
 ]
-valid_mask = df[phq9_items].isin([0, 1, 2, 3])
-valid_counts = valid_mask.sum(axis=1)
-df = df[valid_counts >= 6].copy()
-
-# Nullify invalid PHQ-9 responses
-df.loc[:, phq9_items] = df[phq9_items].where(valid_mask)
-
-# Compute total PHQ-9 score
-df["PHQ9_TOTAL"] = df[phq9_items].sum(axis=1)
-
-# Drop individual PHQ-9 items; rename DPQ100
-df.drop(columns=phq9_items, inplace=True)
-df.rename(columns={"DPQ100": "Difficulty these problems have caused"}, inplace=True)
-
-# --- Apply recoding for modeling ---
 
 # Binary yes/no variables (1 = yes; else = no)
 binary_vars = [
@@ -97,9 +81,6 @@ binary_vars = [
     "Past 12 months had video conf w/Dr?",
     "Seen mental health professional/past yr"
 ]
-for col in binary_vars:
-    if col in df.columns:
-        df[col] = df[col].map({1: 1, 2: 0})
 
 # Insurance type flags: filled = 1, blank = 0
 insurance_cols = [
@@ -108,18 +89,16 @@ insurance_cols = [
     "Covered by military health care", "Covered by state-sponsored health plan",
     "Covered by other government insurance"
 ]
-for col in insurance_cols:
-    if col in df.columns:
-        df[col] = df[col].notna().astype(int)
-
-# Gender: 1 = male → 0, 2 = female → 1
-if "Gender" in df.columns:
-    df["Gender"] = df["Gender"].map({1: 0, 2: 1})
 
-# Drop unused insurance columns
-df.drop(columns=["Covered by CHIP", "Covered by other government insurance"], inplace=True, errors="ignore")
+# Low-cardinality whole-number codes (1/2, 7/9, 77/99) that never carry the
+# placeholder zero, narrowed to nullable Int8 at read time (so by NHANES name)
+# so the row filters and recodes move 1-byte values. PHQ-9 items and age stay
+# float64 because their zeros arrive as the placeholder.
+low_card_cols = ["Gender"] + binary_vars + insurance_cols
+nhanes_names = {new: old for old, new in column_mapping.items()}
+int8_cols = ["RIDSTATR"] + [nhanes_names[col] for col in low_card_cols]
 
-# Convert fields to int for modeling
+# Fields converted to int for modeling
 columns_to_convert = binary_vars + insurance_cols + [
     "Gender",
     "Education level - Adults 20+",
@@ -131,11 +110,188 @@ columns_to_convert = binary_vars + insurance_cols + [
     "Age in years at screening",
     "Total number of people in the Household"
 ]
-for col in columns_to_convert:
-    if col in df.columns:
-        df[col] = df[col].fillna(0).astype(int)
-
-# Save to new location
-output_path = os.path.join(output_dir, "sl_seqn_demo.csv")
-df.to_csv(output_path, index=False)
-print(f"✅ sl_seqn_demo.csv saved to {output_path}")
+
+# Counts rather than codes among the converted fields, kept as int16 so an
+# out-of-range value is not wrapped by the int8 cast used for the codes
+count_cols = ["Age in years at screening", "Total number of people in the Household"]
+
+
+def _score_phq9_numpy(phq):
+    """Return each row's count of valid (0-3) PHQ-9 answers and their total."""
+    valid = np.isin(phq, [0, 1, 2, 3])
+    counts = np.count_nonzero(valid, axis=1)
+    totals = np.where(valid, phq, 0).sum(axis=1).astype(np.int16)
+    return counts, totals
+
+
+# Set SEQN_DEMO_NUMBA=1 to score with the Numba kernel below. The NumPy scorer
+# is the default: it takes a few milliseconds, less than the kernel's JIT compile
+if os.environ.get("SEQN_DEMO_NUMBA", "0") != "1":
+    score_phq9 = _score_phq9_numpy
+else:
+    from numba import njit, prange
+
+    @njit(parallel=True, cache=True)
+    def score_phq9(phq):
+        """Single-pass JIT version of _score_phq9_numpy, parallel over rows."""
+        n, k = phq.shape
+        counts = np.empty(n, np.int8)
+        totals = np.empty(n, np.int16)
+        for i in prange(n):
+            c = 0
+            t = 0
+            for j in range(k):
+                v = phq[i, j]
+                if v == 0 or v == 1 or v == 2 or v == 3:
+                    c += 1
+                    t += int(v)
+            counts[i] = c
+            totals[i] = t
+        return counts, totals
+
+
+def load_chunks(path=merged_raw_path):
+    """Yield merged.csv (already includes DEMO) in chunks, skipping the unused text columns."""
+    header = pd.read_csv(path, nrows=0).columns
+    keep_cols = [col for col in header if col not in skip_cols]
+    narrow = [col for col in int8_cols if col in keep_cols]
+    if legacy_csv:
+        dtypes = {"SEQN": str, **{col: "Int8" for col in narrow}}
+        yield from pd.read_csv(path, usecols=keep_cols, dtype=dtypes, chunksize=chunk_rows)
+        return
+
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    # The streaming reader fixes types from the first block, so pin them
+    # (every kept column besides SEQN is numeric, as full-file inference finds)
+    column_types = {col: pa.float64() for col in keep_cols}
+    column_types["SEQN"] = pa.string()
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=chunk_bytes),
+        convert_options=pacsv.ConvertOptions(include_columns=keep_cols, column_types=column_types),
+    )
+    # Arrow will not parse "2.0" as int8, so cast each batch (a checked cast)
+    # before it reaches pandas
+    schema = reader.schema
+    for col in narrow:
+        schema = schema.set(schema.get_field_index(col), pa.field(col, pa.int8()))
+    for batch in reader:
+        yield batch.cast(schema).to_pandas(types_mapper={pa.int8(): pd.Int8Dtype()}.get)
+
+
+def load_clean(path=merged_raw_path):
+    """Clean merged.csv chunk by chunk and stitch the kept rows together."""
+    return pd.concat([build(chunk) for chunk in load_chunks(path)], ignore_index=True)
+
+
+def build(df):
+    """Filter and recode the merged NHANES frame into the SEQN-linked modeling table.
+
+    Every step is row-local, so this runs on each chunk of merged.csv independently.
+    """
+    # Rename once up front; everything below uses the readable names
+    df = df.rename(columns=column_mapping)
+
+    # Replace placeholder float with NaN
+    float_cols = df.select_dtypes(include=[np.float64, np.float32]).columns
+    values = df[float_cols].to_numpy()
+    df[float_cols] = np.where(values == placeholder, np.nan, values)
+
+    # Filter: Adults (18+) who completed both interview and exam. pd.eval uses
+    # numexpr when installed to fuse both comparisons and the AND in one pass;
+    # it is given plain ndarrays because numexpr rejects the nullable Int8 column.
+    age = df["Age in years at screening"].to_numpy()
+    status = df["RIDSTATR"].to_numpy(dtype=np.float64, na_value=np.nan)
+    df = df.loc[pd.eval("(age >= 18) & (status == 2)")]
+
+    # Remove invalid codes: 7, 9, 77, 99
+    numeric = df.select_dtypes(include=[np.int64, np.float64, "Int8"])
+    invalid_rows = np.isin(numeric.to_numpy(dtype=np.float64, na_value=np.nan), invalid_vals).any(axis=1)
+
+    # Drop the unused columns once the mask is built, so the row selection
+    # only copies the columns that are kept
+    df = df.drop(columns=[col for col in drop_cols if col in df.columns])
+    df = df.loc[~invalid_rows]
+
+    # Filter: PHQ-9 valid (≥6 non-null answers)
+    # and compute the total score, counting invalid responses as 0
+    counts, totals = score_phq9(df[phq9_items].to_numpy(dtype=np.float64))
+    keep = counts >= 6
+    df = df.loc[keep]
+    df["PHQ9_TOTAL"] = totals[keep]
+
+    # Drop individual PHQ-9 items
+    df.drop(columns=phq9_items, inplace=True)
+
+    # --- Apply recoding for modeling ---
+
+    # Drop unused insurance columns up front so they are never recoded
+    df.drop(columns=["Covered by CHIP", "Covered by other government insurance"], inplace=True, errors="ignore")
+
+    # Resolve which modeling columns are present once, not per lookup
+    cols_set = set(df.columns)
+    binary_present = [col for col in binary_vars if col in cols_set]
+    insurance_present = [col for col in insurance_cols if col in cols_set]
+    convert_present = [col for col in columns_to_convert if col in cols_set]
+
+    for col in binary_present:
+        df[col] = df[col].eq(1).to_numpy(dtype=bool, na_value=False).astype(np.int8)
+
+    df[insurance_present] = df[insurance_present].notna().astype(np.int8)
+
+    # Gender: 1 = male → 0, 2 = female → 1 (missing → 0)
+    if "Gender" in cols_set:
+        df["Gender"] = df["Gender"].eq(2).to_numpy(dtype=bool, na_value=False).astype(np.int8)
+
+    # The codes are small NHANES values, so int8 fits; the counts get int16
+    codes_present = [col for col in convert_present if col not in count_cols]
+    counts_present = [col for col in convert_present if col in count_cols]
+    df[codes_present] = df[codes_present].fillna(0).astype(np.int8)
+    df[counts_present] = df[counts_present].fillna(0).astype(np.int16)
+
+    return df
+
+
+def save(df):
+    """Write the modeling table as CSV, plus Parquet and Feather copies unless in legacy mode."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    output_path = os.path.join(output_dir, "sl_seqn_demo.csv")
+    if legacy_csv:
+        df.to_csv(output_path, index=False)
+        print(f"✅ sl_seqn_demo.csv saved to {output_path}")
+        return
+
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    # Convert once; Arrow's writers run in native, multithreaded code. The Arrow
+    # CSV writes whole floats as "12", so read_csv loads gap-free float code
+    # columns as int64 (same values; see README)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pacsv.write_csv(table, output_path, pacsv.WriteOptions(quoting_style="needed"))
+    print(f"✅ sl_seqn_demo.csv saved to {output_path}")
+
+    # Parquet copy for faster re-reads downstream
+    parquet_path = os.path.join(output_dir, "sl_seqn_demo.parquet")
+    pq.write_table(table, parquet_path, compression="zstd", use_dictionary=True)
+    print(f"✅ sl_seqn_demo.parquet saved to {parquet_path}")
+
+    # Feather copy: the fastest load for programmatic consumers; the CSV is
+    # kept for human inspection
+    feather_path = os.path.join(output_dir, "sl_seqn_demo.feather")
+    feather.write_feather(table, feather_path, compression="zstd")
+    print(f"✅ sl_seqn_demo.feather saved to {feather_path}")
+
+
+if __name__ == "__main__":
+    # SEQN_DEMO_ENGINE=polars runs the equivalent Polars pipeline instead
+    if os.environ.get("SEQN_DEMO_ENGINE", "pandas") == "polars":
+        from recover_seqn_demo_polars import main
+        main()
+    else:
+        save(load_clean())
@@ -0,0 +1,123 @@
+import os
+import polars as pl
+
+from recover_seqn_demo import (
+    merged_raw_path, output_dir, legacy_csv, skip_cols, placeholder, invalid_vals,
+    drop_cols, column_mapping, phq9_items, binary_vars, insurance_cols, columns_to_convert,
+    count_cols, int8_cols,
+)
+
+# Polars version of recover_seqn_demo.py: same filters and recodes, run as one
+# lazy, streaming query. Select it with SEQN_DEMO_ENGINE=polars or run directly.
+
+
+def scan(path=merged_raw_path):
+    """Lazily scan merged.csv with SEQN as text, the code columns as Int8 and the rest as float."""
+    header = pl.read_csv(path, n_rows=0).columns
+    keep_cols = [col for col in header if col not in skip_cols]
+    schema = {col: pl.Float64 for col in keep_cols}
+    schema["SEQN"] = pl.Utf8
+    # The CSV writes codes as "2.0", so parse as float and narrow in the scan.
+    # The cast alone would truncate 2.5 to 2; non-whole values go to NaN first so
+    # the strict cast rejects them, as Arrow's checked cast does on the pandas path
+    narrow = pl.col([col for col in int8_cols if col in keep_cols])
+    whole = (narrow == narrow.round()) | narrow.is_null()
+    return (
+        pl.scan_csv(path, schema_overrides=schema)
+        .select(keep_cols)
+        .with_columns(pl.when(whole).then(narrow).otherwise(float("nan")).cast(pl.Int8))
+    )
+
+
+def build(lf):
+    """Filter and recode the merged NHANES scan into the SEQN-linked modeling table."""
+    floats = pl.col(pl.Float64)
+    # is_in needs the code lists in the columns' own (float) dtype
+    invalid_codes = [float(v) for v in invalid_vals]
+
+    # Rename once up front; everything below uses the readable names
+    lf = lf.rename(column_mapping, strict=False)
+
+    # Replace placeholder float with null
+    lf = lf.with_columns(pl.when(floats == placeholder).then(None).otherwise(floats).name.keep())
+
+    # Filter: Adults (18+) who completed both interview and exam
+    lf = lf.filter((pl.col("Age in years at screening") >= 18) & (pl.col("RIDSTATR") == 2))
+
+    # Remove invalid codes: 7, 9, 77, 99
+    numeric = pl.col(pl.Float64, pl.Int8).cast(pl.Float64)
+    lf = lf.filter(~pl.any_horizontal(numeric.is_in(invalid_codes).fill_null(False)))
+
+    lf = lf.drop(drop_cols, strict=False)
+
+    # Filter: PHQ-9 valid (≥6 non-null answers)
+    valid = [pl.col(col).is_in([0.0, 1.0, 2.0, 3.0]).fill_null(False) for col in phq9_items]
+    lf = lf.filter(pl.sum_horizontal(valid) >= 6)
+
+    # Compute total PHQ-9 score, counting invalid responses as 0
+    scored = [pl.when(v).then(pl.col(col)).otherwise(0) for v, col in zip(valid, phq9_items)]
+    lf = lf.with_columns(pl.sum_horizontal(scored).cast(pl.Int16).alias("PHQ9_TOTAL"))
+
+    # Drop individual PHQ-9 items
+    lf = lf.drop(phq9_items)
+
+    # --- Apply recoding for modeling ---
+
+    # Drop unused insurance columns up front so they are never recoded
+    lf = lf.drop(["Covered by CHIP", "Covered by other government insurance"], strict=False)
+
+    # Resolve which modeling columns are present once, not per lookup
+    cols_set = set(lf.collect_schema().names())
+    binary_present = [col for col in binary_vars if col in cols_set]
+    insurance_present = [col for col in insurance_cols if col in cols_set]
+    convert_present = [col for col in columns_to_convert if col in cols_set]
+
+    lf = lf.with_columns(
+        [(pl.col(col) == 1).fill_null(False).cast(pl.Int8) for col in binary_present]
+        + [pl.col(col).is_not_null().cast(pl.Int8) for col in insurance_present]
+    )
+
+    # Gender: 1 = male → 0, 2 = female → 1 (missing → 0)
+    if "Gender" in cols_set:
+        lf = lf.with_columns((pl.col("Gender") == 2).fill_null(False).cast(pl.Int8))
+
+    # The codes are small NHANES values, so int8 fits; the counts get int16
+    return lf.with_columns([
+        pl.col(col).fill_null(0).cast(pl.Int16 if col in count_cols else pl.Int8)
+        for col in convert_present
+    ])
+
+
+def save(df):
+    """Write the modeling table as CSV, plus Parquet and Feather copies unless in legacy mode."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    output_path = os.path.join(output_dir, "sl_seqn_demo.csv")
+    if legacy_csv:
+        df.write_csv(output_path)
+        print(f"✅ sl_seqn_demo.csv saved to {output_path}")
+        return
+
+    # Same Arrow writer as the pandas path, so both engines write the same CSV
+    import pyarrow.csv as pacsv
+
+    pacsv.write_csv(df.to_arrow(), output_path, pacsv.WriteOptions(quoting_style="needed"))
+    print(f"✅ sl_seqn_demo.csv saved to {output_path}")
+
+    # Parquet copy for faster re-reads downstream
+    parquet_path = os.path.join(output_dir, "sl_seqn_demo.parquet")
+    df.write_parquet(parquet_path, compression="zstd")
+    print(f"✅ sl_seqn_demo.parquet saved to {parquet_path}")
+
+    # Feather (Arrow IPC) copy: the fastest load for programmatic consumers
+    feather_path = os.path.join(output_dir, "sl_seqn_demo.feather")
+    df.write_ipc(feather_path, compression="zstd")
+    print(f"✅ sl_seqn_demo.feather saved to {feather_path}")
+
+
+def main():
+    save(build(scan()).collect(engine="streaming"))
+
+
+if __name__ == "__main__":
+    main()